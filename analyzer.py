@@ -4,26 +4,47 @@
 # считает циклы (open -> close) для каждой комбинации open/close,
 # сохраняет TOP-5 комбинаций (open, close, cycles) для каждой пары в analysis.json.
 
+import asyncio
+import aiohttp
 import requests
 import time
+import numba
+import numpy as np
+import orjson
 import json
 import os
 from math import isclose
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime, timedelta
 
 PAIRS_FILE = "pairs.json"
 ANALYSIS_FILE = "analysis.json"
+ANALYSIS_CACHE_FILE = "analysis_cache.json"
 
 # Параметры перебора (утверждены тобой)
 OPEN_MIN = 4.0
 OPEN_MAX = 30.0
 OPEN_STEP = 0.5
 CLOSE_STEP = 0.5
+TOP_K = 5
 DAYS = 30
 HOURS = DAYS * 24
+# сетка порогов: open OPEN_MIN..OPEN_MAX, close 0..(open - 4) inclusive;
+# шаги кратны 0.5 — значения точно представимы во float32
+OPEN_THRESHOLDS = np.arange(OPEN_MIN, OPEN_MAX + OPEN_STEP / 2, OPEN_STEP, dtype=np.float32)
+CLOSE_THRESHOLDS = np.arange(0.0, OPEN_THRESHOLDS.max() - 4.0 + CLOSE_STEP / 2, CLOSE_STEP, dtype=np.float32)
 
 # Binance kline endpoint (futures)
 KLINES_URL = "https://fapi.binance.com/fapi/v1/klines"
+# сколько запросов свечей держим одновременно (asyncio + aiohttp)
+FETCH_CONCURRENCY = 32
+# синхронная сессия — для догрузки отдельных символов из analyze_pair
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(
+    pool_connections=16, pool_maxsize=64,
+    max_retries=Retry(total=3, backoff_factor=0.3),
+))
 
 def load_pairs():
     with open(PAIRS_FILE, "r", encoding="utf-8") as f:
@@ -33,78 +54,188 @@ def save_analysis(data):
     with open(ANALYSIS_FILE, "w", encoding="utf-8") as f:
         json.dump(data, f, indent=2, ensure_ascii=False)
 
+def load_analysis_cache():
+    if not os.path.exists(ANALYSIS_CACHE_FILE):
+        return {}
+    try:
+        with open(ANALYSIS_CACHE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+def save_analysis_cache(data):
+    with open(ANALYSIS_CACHE_FILE, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+
+# результаты analyze_pair по ключу analysis_cache_key (живёт между вызовами main)
+_analyze_cache = {}
+
+def analysis_cache_key(p1_sym, p2_sym, coef, klines_cache):
+    """
+    Ключ кеша: пара, coef и время последней свечи обоих символов —
+    пока Binance не выдал новый час, результат анализа тот же.
+    Если свечей нет — None (не кешируем).
+    """
+    kl1 = klines_cache.get(p1_sym)
+    kl2 = klines_cache.get(p2_sym)
+    if kl1 is None or kl2 is None or not len(kl1[0]) or not len(kl2[0]):
+        return None
+    return f"{p1_sym}-{p2_sym}|{coef}|{int(kl1[0][-1])}|{int(kl2[0][-1])}"
+
+def parse_klines(data):
+    """Ответ /klines -> (timestamps_ms: int64[:], close: float32[:])."""
+    if not data:
+        return np.empty(0, np.int64), np.empty(0, np.float32)
+    # колонки разбирает NumPy: 0 — open time ms, 4 — close (строка)
+    rows = np.array(data, dtype=object)
+    return rows[:, 0].astype(np.int64), rows[:, 4].astype(np.float64).astype(np.float32)
+
 def fetch_klines_close(symbol, limit=HOURS, interval="1h"):
     """
-    Возвращает список (timestamp_ms, close_price) длиной <= limit.
+    Возвращает (timestamps_ms: int64[:], close: float32[:]) длиной <= limit.
     Если ошибка — возвращает None.
     """
     params = {"symbol": symbol, "interval": interval, "limit": limit}
     try:
-        r = requests.get(KLINES_URL, params=params, timeout=20)
+        r = _session.get(KLINES_URL, params=params, timeout=20)
         r.raise_for_status()
-        data = r.json()
-        res = []
-        for row in data:
-            ts = int(row[0])  # open time ms
-            close = float(row[4])
-            res.append((ts, close))
-        return res
+        return parse_klines(orjson.loads(r.content))
     except Exception as e:
         print(f"[ERROR] fetch_klines_close {symbol}: {e}")
         return None
 
+async def fetch_klines_async(session, symbol, limit=HOURS, interval="1h"):
+    """Асинхронный вариант fetch_klines_close на общей aiohttp-сессии."""
+    params = {"symbol": symbol, "interval": interval, "limit": limit}
+    try:
+        async with session.get(KLINES_URL, params=params) as r:
+            r.raise_for_status()
+            return parse_klines(await r.json(loads=orjson.loads))
+    except Exception as e:
+        print(f"[ERROR] fetch_klines_async {symbol}: {e}")
+        return None
+
+async def fetch_all_klines(symbols):
+    """Скачивает свечи всех символов одновременно. Возвращает {symbol: klines | None}."""
+    connector = aiohttp.TCPConnector(limit=FETCH_CONCURRENCY)
+    timeout = aiohttp.ClientTimeout(total=20)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        results = await asyncio.gather(*[fetch_klines_async(session, sym) for sym in symbols])
+    return dict(zip(symbols, results))
+
 def align_series(a, b):
     """
-    a, b: lists of (ts_ms, price)
-    Возвращает две списочные последовательности цен, выровненные по общим timestamp (по порядку возрастания).
+    a, b: пары массивов (ts_ms, price), Binance отдаёт их по возрастанию времени.
+    Возвращает общие timestamp и две последовательности цен, выровненные по ним.
     Если мало пересечений, вернёт минимально возможное количество точек.
     """
-    dict_a = {ts: p for ts, p in a}
-    dict_b = {ts: p for ts, p in b}
-    common = sorted(set(dict_a.keys()) & set(dict_b.keys()))
-    series_a = [dict_a[ts] for ts in common]
-    series_b = [dict_b[ts] for ts in common]
-    return common, series_a, series_b
+    ts_a, pr_a = a
+    ts_b, pr_b = b
+    common, ia, ib = np.intersect1d(ts_a, ts_b, assume_unique=True, return_indices=True)
+    return common, pr_a[ia], pr_b[ib]
 
 def calc_spread_list(series_a, series_b, coef):
-    """Возвращает список spread% для каждой точки. Масштабируем дешевую монету (как обсуждалось)."""
-    spreads = []
-    for pa, pb in zip(series_a, series_b):
-        # масштабируем дешевую монету чтобы приблизить цены
-        if pa < pb:
-            pa_s = pa * coef
-            pb_s = pb
-        else:
-            pa_s = pa
-            pb_s = pb * coef
-        # процент от среднего
-        denom = (pa_s + pb_s) / 2.0
-        if denom == 0:
-            spreads.append(0.0)
-        else:
-            spreads.append(abs(pa_s - pb_s) / denom * 100.0)
-    return spreads
-
-def count_cycles_for_thresholds(spreads, open_thr, close_thr):
+    """Возвращает float32 массив spread% для каждой точки. Масштабируем дешевую монету (как обсуждалось)."""
+    pa = np.asarray(series_a, dtype=np.float32)
+    pb = np.asarray(series_b, dtype=np.float32)
+    # масштабируем дешевую монету чтобы приблизить цены (min/max вместо веток)
+    small = np.minimum(pa, pb) * coef
+    big = np.maximum(pa, pb)
+    # процент от среднего (0 там, где среднее нулевое)
+    denom = (small + big) / 2.0
+    spreads = np.divide(np.abs(small - big), denom, out=np.zeros_like(denom), where=denom != 0)
+    return spreads * 100.0
+
+def turning_points(spreads):
+    """
+    Сжимает ряд спредов до последовательности локальных экстремумов (с краями).
+    Для любых open > close число циклов на сжатом ряду то же самое: внутри
+    монотонного участка state machine может сработать только на его крайней
+    точке, а повторы подряд ничего не меняют. Обычно это в разы короче HOURS.
+    """
+    # убираем плато (повторяющиеся подряд значения)
+    s = spreads[np.r_[True, spreads[1:] != spreads[:-1]]] if spreads.size else spreads
+    if s.size < 3:
+        return s
+    rising = np.diff(s) > 0
+    keep = np.r_[True, rising[:-1] != rising[1:], True]
+    return np.ascontiguousarray(s[keep])
+
+def threshold_hits(spreads, thresholds, above):
+    """
+    Для каждого порога — отсортированные индексы часов, где spread >= thr
+    (above=True) или spread <= thr (above=False). Считается один раз на пару.
+    Возвращает (hits, ptr) в CSR-виде: hits[ptr[t]:ptr[t + 1]] — индексы порога t.
+    """
+    if above:
+        mask = spreads[None, :] >= thresholds[:, None]
+    else:
+        mask = spreads[None, :] <= thresholds[:, None]
+    rows, hits = np.nonzero(mask)
+    ptr = np.zeros(thresholds.size + 1, np.int64)
+    np.cumsum(np.bincount(rows, minlength=thresholds.size), out=ptr[1:])
+    return hits, ptr
+
+@numba.njit(cache=True, fastmath=True, boundscheck=False)
+def count_cycles(open_hits, close_hits):
     """
     Простой state machine:
     - waiting for open: ищем spread >= open_thr
     - затем waiting for close: ищем spread <= close_thr
     когда найден close, count++ и возвращаемся в waiting for open
     Возвращаем число завершённых циклов.
+    Вместо прохода по часам прыгаем по готовым индексам (open_hits / close_hits)
+    бинарным поиском — O(log H) на цикл.
     """
-    state = "waiting_open"
     count = 0
-    for s in spreads:
-        if state == "waiting_open":
-            if s >= open_thr:
-                state = "waiting_close"
-        elif state == "waiting_close":
-            if s <= close_thr:
-                count += 1
-                state = "waiting_open"
+    p = 0
+    while p < open_hits.size:
+        # первый close строго после текущего open
+        j = np.searchsorted(close_hits, open_hits[p], side="right")
+        if j == close_hits.size:
+            break
+        count += 1
+        # следующий open строго после найденного close
+        p = np.searchsorted(open_hits, close_hits[j], side="right")
     return count
 
+@numba.njit(cache=True, parallel=True)
+def _cycle_grid(open_hits, open_ptr, close_hits, close_ptr, opens, closes):
+    out = np.zeros((opens.size, closes.size), np.int32)
+    for oi in numba.prange(opens.size):
+        ot = opens[oi]
+        oh = open_hits[open_ptr[oi]:open_ptr[oi + 1]]
+        for ci in range(closes.size):
+            if closes[ci] > ot - 4.0:
+                continue
+            out[oi, ci] = count_cycles(oh, close_hits[close_ptr[ci]:close_ptr[ci + 1]])
+    return out
+
+def cycle_grid(spreads, opens, closes):
+    """
+    Считает циклы сразу для всей сетки порогов: out[oi, ci] — число циклов
+    для (opens[oi], closes[ci]). Комбинации с close > open - 4 остаются 0.
+    Внешний цикл по open распараллелен (prange).
+    """
+    open_hits, open_ptr = threshold_hits(spreads, opens, above=True)
+    close_hits, close_ptr = threshold_hits(spreads, closes, above=False)
+    return _cycle_grid(open_hits, open_ptr, close_hits, close_ptr, opens, closes)
+
+def top_cells(grid, k):
+    """
+    Индексы (в grid.ravel()) k ячеек с наибольшим числом циклов, только cycles > 0.
+    Порядок: cycles desc, при равенстве — как при переборе (open asc, close asc).
+    Без сортировки всей сетки: k-е значение ищем через argpartition.
+    """
+    flat = grid.ravel()
+    cand = np.flatnonzero(flat > 0)
+    if cand.size > k:
+        vals = flat[cand]
+        kth = vals[np.argpartition(vals, -k)[-k]]
+        above = cand[vals > kth]
+        cand = np.concatenate((above, cand[vals == kth][:k - above.size]))
+    return cand[np.lexsort((cand, -flat[cand]))]
+
 def analyze_pair(p1_sym, p2_sym, coef, klines_cache):
     """
     Загружает/использует кешированные свечи и считает топ-5 (open,close,cycles).
@@ -130,36 +261,32 @@ def analyze_pair(p1_sym, p2_sym, coef, klines_cache):
         # всё равно пытаемся
     # рассчитываем спреды
     spreads = calc_spread_list(series1, series2, coef)
-    # перебор open/close
-    results = []
-    open_val = OPEN_MIN
-    while open_val <= OPEN_MAX + 1e-9:
-        # close range: 0 .. (open - 4) inclusive
-        max_close = round(open_val - 4.0 + 1e-9, 10)
-        if max_close < 0:
-            open_val = round(open_val + OPEN_STEP, 10)
-            continue
-        close_val = 0.0
-        while close_val <= max_close + 1e-9:
-            # считаем циклы
-            cycles = count_cycles_for_thresholds(spreads, open_val, close_val)
-            if cycles > 0:
-                results.append((open_val, close_val, cycles))
-            close_val = round(close_val + CLOSE_STEP, 10)
-        open_val = round(open_val + OPEN_STEP, 10)
-    if not results:
-        return []
-    # сортируем по cycles desc, возьмем top5
-    results.sort(key=lambda x: x[2], reverse=True)
-    top5 = results[:5]
-    out = [{"open": float(round(r[0], 2)), "close": float(round(r[1], 2)), "cycles": int(r[2])} for r in top5]
+    # для циклов важны только пики и впадины — сжимаем ряд перед перебором
+    spreads = turning_points(spreads)
+    # перебор open/close одним вызовом ядра
+    grid = cycle_grid(spreads, OPEN_THRESHOLDS, CLOSE_THRESHOLDS)
+    n_close = CLOSE_THRESHOLDS.size
+    out = [
+        {"open": float(round(OPEN_THRESHOLDS[i // n_close], 2)),
+         "close": float(round(CLOSE_THRESHOLDS[i % n_close], 2)),
+         "cycles": int(grid.flat[i])}
+        for i in top_cells(grid, TOP_K)
+    ]
     return out
 
 def main():
     pairs = load_pairs()
-    klines_cache = {}
     analysis = {}
     t0 = time.time()
+    # скачиваем свечи всех символов параллельно, анализ дальше работает по кешу;
+    # не скачанные символы analyze_pair догрузит синхронно (с ретраями)
+    symbols = set(pairs) | {info["pair2"] for info in pairs.values()}
+    print(f"Загрузка свечей для {len(symbols)} символов ...")
+    fetched = asyncio.run(fetch_all_klines(list(symbols)))
+    klines_cache = {sym: kl for sym, kl in fetched.items() if kl is not None}
+    if not _analyze_cache:
+        _analyze_cache.update(load_analysis_cache())
+    used_cache = {}
     total = len(pairs)
     i = 0
     for p1, info in pairs.items():
@@ -168,7 +295,14 @@ def main():
         coef = info.get("coef", 1.0)
         print(f"\n[{i}/{total}] Анализ пары {p1}-{p2} (coef={coef}) ...")
         try:
-            res = analyze_pair(p1, p2, coef, klines_cache)
+            cache_key = analysis_cache_key(p1, p2, coef, klines_cache)
+            if cache_key in _analyze_cache:
+                res = _analyze_cache[cache_key]
+                print("  → Новых свечей нет, результат из кеша.")
+            else:
+                res = analyze_pair(p1, p2, coef, klines_cache)
+            if res is not None and cache_key is not None:
+                used_cache[cache_key] = res
             if res is None:
                 print(f"[SKIP] Не удалось получить данные для {p1}-{p2}")
                 continue
@@ -176,6 +310,10 @@ def main():
             print(f"  → Найдено {len(res)} комбинаций (top5 saved).")
         except Exception as e:
             print(f"[ERROR] {p1}-{p2}: {e}")
+    # в кеше оставляем только актуальные ключи, чтобы файл не рос
+    _analyze_cache.clear()
+    _analyze_cache.update(used_cache)
+    save_analysis_cache(used_cache)
     # сохраняем
     save_analysis({
         "generated_at": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
@@ -5,6 +5,9 @@ import time
 import json
 import os
 import threading
+from concurrent.futures import ThreadPoolExecutor
+import orjson
+import websocket
 from flask import Flask, request
 
 app = Flask(__name__)
@@ -16,7 +19,9 @@ PAIRS_FILE = "pairs.json"
 STATE_FILE = "state.json"
 ANALYSIS_FILE = "analysis.json"
 
-CHECK_INTERVAL = 10
+BROADCAST_WORKERS = 16
+CHECK_INTERVAL = 0.5  # пока живы цены из WebSocket, HTTP в цикле нет
+REST_CHECK_INTERVAL = 10  # стрим недоступен — опрашиваем REST как раньше
 STATUS_EMOJI = "🐬"
 
 # ---------------- helpers ----------------
@@ -34,8 +39,11 @@ def load_json(path, default):
         return default
 
 def save_json(path, data):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    # пишем во временный файл и атомарно подменяем — при падении файл не бьётся
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    os.replace(tmp, path)
 
 pairs = load_pairs()
 state = load_json(STATE_FILE, {})
@@ -51,7 +59,60 @@ if "cycles" not in state:
     save_json(STATE_FILE, state)
 
 # --------------- Binance API ---------------
+# REST не чаще раза за REST_CHECK_INTERVAL на символ — даже когда цикл идёт по 0.5s
+PRICE_TTL = REST_CHECK_INTERVAL
+_price_cache = {}  # symbol -> (monotonic ts, mid price | None при неудаче)
+_price_lock = threading.Lock()
+
+# live bid/ask из WebSocket bookTicker: symbol -> (monotonic ts, bid, ask)
+BOOK_TICKER_WS = "wss://fstream.binance.com/stream?streams="
+WS_RECONNECT_DELAY = 5
+WS_PING_INTERVAL = 20
+WS_PING_TIMEOUT = 10
+QUOTE_MAX_AGE = 5  # секунды: более старая котировка считается отсутствующей
+_prices = {}
+_last_message_at = 0.0
+
+def _on_book_ticker(ws, message):
+    global _last_message_at
+    now = time.monotonic()
+    _last_message_at = now
+    data = orjson.loads(message).get("data", {})
+    if "s" in data:
+        _prices[data["s"]] = (now, float(data["b"]), float(data["a"]))
+
+def price_stream_live():
+    return time.monotonic() - _last_message_at < QUOTE_MAX_AGE
+
+def price_stream_loop():
+    """
+    Подписка на bookTicker всех символов из pairs.json одним combined stream.
+    При обрыве соединения цены сбрасываются (get_price уходит на REST) и
+    подключаемся заново.
+    """
+    symbols = set(pairs) | {info["pair2"] for info in pairs.values()}
+    url = BOOK_TICKER_WS + "/".join(f"{s.lower()}@bookTicker" for s in sorted(symbols))
+    print("Price stream started")
+    while True:
+        ws = websocket.WebSocketApp(url, on_message=_on_book_ticker)
+        try:
+            # ping_timeout рвёт полуоткрытое соединение вместо замёрзших цен
+            ws.run_forever(ping_interval=WS_PING_INTERVAL, ping_timeout=WS_PING_TIMEOUT)
+        except Exception as e:
+            print(f"[ERROR] price stream: {e}")
+        _prices.clear()
+        time.sleep(WS_RECONNECT_DELAY)
+
 def get_price(symbol, retries=3, delay=0.25):
+    quote = _prices.get(symbol)
+    if quote is not None and time.monotonic() - quote[0] < QUOTE_MAX_AGE:
+        return (quote[1] + quote[2]) / 2.0
+    # REST fallback: стрим не подключён или котировка устарела
+    with _price_lock:
+        cached = _price_cache.get(symbol)
+    # неудачный запрос тоже кешируем — иначе цикл по 0.5s долбит REST ретраями
+    if cached and time.monotonic() - cached[0] < PRICE_TTL:
+        return cached[1]
     url = f"https://fapi.binance.com/fapi/v1/ticker/bookTicker?symbol={symbol}"
     for _ in range(retries):
         try:
@@ -61,9 +122,14 @@ def get_price(symbol, retries=3, delay=0.25):
                 time.sleep(delay)
                 continue
             bid = float(data["bidPrice"]); ask = float(data["askPrice"])
-            return (bid + ask) / 2.0
+            mid = (bid + ask) / 2.0
+            with _price_lock:
+                _price_cache[symbol] = (time.monotonic(), mid)
+            return mid
         except:
             time.sleep(delay)
+    with _price_lock:
+        _price_cache[symbol] = (time.monotonic(), None)
     return None
 
 def calc_spread(p1, p2):
@@ -72,6 +138,15 @@ def calc_spread(p1, p2):
     except:
         return 0.0
 
+def scale_cheaper(p1_price, p2_price, coef):
+    """
+    Масштабируем дешёвую монету на coef: цены через min/max.
+    Возвращает (scaled1, scaled2) в порядке p1/p2.
+    """
+    small = min(p1_price, p2_price) * coef
+    big = max(p1_price, p2_price)
+    return (small, big) if p1_price < p2_price else (big, small)
+
 def fmt_coef(coef):
     try:
         if abs(coef - int(coef)) < 1e-9:
@@ -101,14 +176,22 @@ def send_telegram(chat_id, msg):
     except Exception as e:
         print(f"[ERROR] send_telegram: {e}")
 
+# подписчики держим в памяти, файл пишем только на /start и /stop
+_subscribers = load_subscribers()
+_subscribers_lock = threading.Lock()
+
 def broadcast(msg):
-    for cid in load_subscribers():
-        send_telegram(cid, msg)
+    with _subscribers_lock:
+        subs = list(_subscribers)
+    with ThreadPoolExecutor(max_workers=BROADCAST_WORKERS) as ex:
+        list(ex.map(lambda cid: send_telegram(cid, msg), subs))
 
 # --------------- Signal loop (existing behavior) ---------------
 def check_pairs_loop():
     print("Signal loop started")
     while True:
+        # state сбрасываем на диск не чаще раза за проход
+        state_dirty = False
         for p1, info in pairs.items():
             p2 = info["pair2"]
             coef = info.get("coef", 1.0)
@@ -121,14 +204,8 @@ def check_pairs_loop():
             if price1 is None or price2 is None:
                 continue
 
-            if price1 < price2:
-                scaled1 = price1 * coef
-                scaled2 = price2
-                scaled_note = f"{p1} * {fmt_coef(coef)}"
-            else:
-                scaled1 = price1
-                scaled2 = price2 * coef
-                scaled_note = f"{p2} * {fmt_coef(coef)}"
+            scaled1, scaled2 = scale_cheaper(price1, price2, coef)
+            scaled_note = f"{p1 if price1 < price2 else p2} * {fmt_coef(coef)}"
 
             spread = calc_spread(scaled1, scaled2)
             long_name, short_name = get_direction_names(p1, scaled1, p2, scaled2)
@@ -136,7 +213,7 @@ def check_pairs_loop():
             current = state.get(key, "inactive")
             if current == "inactive" and spread >= open_spread:
                 state[key] = "active"
-                save_json(STATE_FILE, state)
+                state_dirty = True
                 msg = (
                     f"🚀 {p1}-{p2} {spread:.2f}% — открытие\n"
                     f"{STATUS_EMOJI} Спред: {spread:.2f}% | Коэф: {fmt_coef(coef)}\n"
@@ -150,7 +227,7 @@ def check_pairs_loop():
                 state.setdefault("cycles", {})
                 state["cycles"].setdefault(key, [])
                 state["cycles"][key].append(int(time.time()))
-                save_json(STATE_FILE, state)
+                state_dirty = True
                 msg = (
                     f"🔻 {p1}-{p2} {spread:.2f}% — закрытие\n"
                     f"{STATUS_EMOJI} Спред: {spread:.2f}% | Коэф: {fmt_coef(coef)}\n"
@@ -158,7 +235,9 @@ def check_pairs_loop():
                     f"📝 Масштаб: {scaled_note}"
                 )
                 broadcast(msg)
-        time.sleep(CHECK_INTERVAL)
+        if state_dirty:
+            save_json(STATE_FILE, state)
+        time.sleep(CHECK_INTERVAL if price_stream_live() else REST_CHECK_INTERVAL)
 
 # --------------- Analyzer runner (calls analyzer.py) ---------------
 def run_analyzer_blocking():
@@ -194,18 +273,19 @@ def webhook():
     text = data["message"].get("text", "").strip()
 
     if text == "/start":
-        subs = load_subscribers()
-        if chat_id not in subs:
-            with open(SUBSCRIBERS_FILE, "a", encoding="utf-8") as f:
-                f.write(chat_id + "\n")
+        with _subscribers_lock:
+            if chat_id not in _subscribers:
+                _subscribers.add(chat_id)
+                with open(SUBSCRIBERS_FILE, "a", encoding="utf-8") as f:
+                    f.write(chat_id + "\n")
         send_telegram(chat_id, "🔥 Вы подписаны!")
         return {"ok": True}
 
     if text == "/stop":
-        subs = load_subscribers()
-        subs.discard(chat_id)
-        with open(SUBSCRIBERS_FILE, "w", encoding="utf-8") as f:
-            f.write("\n".join(subs))
+        with _subscribers_lock:
+            _subscribers.discard(chat_id)
+            with open(SUBSCRIBERS_FILE, "w", encoding="utf-8") as f:
+                f.writelines(cid + "\n" for cid in _subscribers)
         send_telegram(chat_id, "❌ Подписка отменена")
         return {"ok": True}
 
@@ -219,12 +299,7 @@ def webhook():
             if price1 is None or price2 is None:
                 lines.append(f"{STATUS_EMOJI} {p1}-{p2} — нет данных\n")
                 continue
-            if price1 < price2:
-                scaled1 = price1 * coef
-                scaled2 = price2
-            else:
-                scaled1 = price1
-                scaled2 = price2 * coef
+            scaled1, scaled2 = scale_cheaper(price1, price2, coef)
             spread = calc_spread(scaled1, scaled2)
             long_name, short_name = get_direction_names(p1, scaled1, p2, scaled2)
             lines.append(f"{STATUS_EMOJI} {p1}-{p2} — Спред: {spread:.2f}% | Коэф: {fmt_coef(coef)}")
@@ -284,5 +359,6 @@ def run_web():
 
 if __name__ == "__main__":
     threading.Thread(target=run_web).start()
+    threading.Thread(target=price_stream_loop, daemon=True).start()
     threading.Thread(target=check_pairs_loop).start()
     print("Bot started.")